@@ -8,22 +8,66 @@ __version__ = "1.2.0"
 
 import os
 import sys
+import argparse
 import subprocess
 import re
 import json
+import shutil
+import stat
+import tempfile
+import hashlib
+import math
+import queue
+import selectors
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
 from datetime import datetime
-from typing import Optional, List, Tuple
+from typing import Optional, List, Tuple, Dict
+
+# orjson があれば使う(標準の json より速く、UTF-8のデコードもC側で済む)
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# PyAV があれば、ffprobeを起動せずプロセス内でコンテナ情報を読む
+try:
+    import av
+except ImportError:
+    av = None
+
+
+@dataclass(frozen=True)
+class VideoMeta:
+    """動画情報のうち計算に使う値 (プローブ結果から1回だけ取り出す)"""
+    __slots__ = ('duration', 'codec', 'width', 'height', 'fps', 'v_bitrate')
+    duration: float
+    # 映像のコーデック名 (映像ストリームがなければ空文字)
+    codec: str
+    width: int
+    height: int
+    # フレームレート (取れなければ0)
+    fps: float
+    # 元の映像ビットレート kbps (取れなければ0)
+    v_bitrate: int
 
 
 class VideoCompressor:
     """動画圧縮を管理するクラス"""
     
-    # サポートする動画形式
-    SUPPORTED_FORMATS = [
+    # サポートする動画形式 (表示用の並び順)
+    SUPPORTED_FORMATS_DISPLAY = [
         '.mp4', '.avi', '.mov', '.mkv', '.flv', 
         '.wmv', '.webm', '.m4v', '.mpeg', '.mpg'
     ]
+    # 判定用
+    SUPPORTED_FORMATS = frozenset(SUPPORTED_FORMATS_DISPLAY)
+    # ディレクトリ走査用 (ドットなし拡張子)
+    _SUFFIX_SET = frozenset(fmt[1:] for fmt in SUPPORTED_FORMATS)
     
     # 変換可能な拡張子
     CONVERT_FORMATS = {
@@ -35,50 +79,373 @@ class VideoCompressor:
         '6': ('flv', 'FLV (Flash Video)'),
     }
     
-    def __init__(self, dry_run: bool = False):
+    # キャッシュ保存先
+    CACHE_DIR = Path.home() / '.cache' / 'video-resizer'
+    
+    # 動画情報(ffprobeの結果)のキャッシュ (パス・サイズ・更新時刻が同じなら使い回す)
+    PROBE_CACHE_DIR = CACHE_DIR / 'probe'
+    # プロセス内に保持する動画情報の件数
+    PROBE_MEMO_SIZE = 32
+    # ディスクに残す動画情報キャッシュの上限件数 (1件数KB)
+    PROBE_CACHE_LIMIT = 2000
+    
+    # 1パス目ログキャッシュの上限サイズ(バイト)
+    PASSLOG_CACHE_LIMIT = 2 * 1024 * 1024 * 1024
+    
+    # 実際のサイズ / 予測サイズ の学習結果 (解像度帯ごと)
+    SIZE_RATIO_FILE = CACHE_DIR / 'overshoot.json'
+    # 学習データがないときの比率 (従来の 0.95 倍と同じ)
+    DEFAULT_SIZE_RATIO = 1 / 0.95
+    # 学習した比率で狙うときに残す余裕
+    SIZE_SAFETY_MARGIN = 0.98
+    
+    # 優先順に並べたH.264ハードウェアエンコーダー
+    HW_ENCODERS = ['h264_videotoolbox', 'h264_nvenc', 'h264_qsv', 'h264_vaapi']
+    VAAPI_DEVICE = '/dev/dri/renderD128'
+    # ハードウェアエンコーダーは同時セッション数に制限があるため、並列数を抑える
+    HW_MAX_PARALLEL = 2
+    
+    # -progress 出力の再生位置 (マイクロ秒。開始直後の N/A にはマッチしない)
+    _OUT_TIME_RE = re.compile(rb'out_time_us=(\d+)')
+    
+    # 進捗バー (満と空を並べた文字列から、バーの長さ分を1回で切り出して使う)
+    _BAR_LENGTH = 40
+    _BAR_TEMPLATE = '█' * _BAR_LENGTH + '░' * _BAR_LENGTH
+    
+    # AAC音声をそのままコピーできる出力コンテナ
+    AAC_COPY_FORMATS = frozenset({'mp4', 'mov', 'm4v', 'mkv', 'flv'})
+    # H.264の映像をそのままコピーできる出力コンテナ
+    H264_COPY_FORMATS = frozenset({'mp4', 'mov', 'm4v', 'mkv', 'flv'})
+    # 目標ビットレートが元の映像ビットレートのこの割合以上なら、再エンコードせずコピーする
+    # (calculate_bitrate の結果にはすでに余裕が含まれている)
+    VIDEO_COPY_MIN_RATIO = 0.95
+    # サイズ比率の学習に使うレート制御 (CRFとコピーは目標サイズを狙わないので除く)
+    SIZE_RATIO_RATE_CONTROLS = frozenset({'2pass', 'hw'})
+    # moov を先頭に置ける(-movflags +faststart が使える)出力コンテナ
+    FASTSTART_FORMATS = frozenset({'mp4', 'mov', 'm4v'})
+    
+    # 解像度ごとの推奨ビットレート kbps (最低の高さ, 最高画質, 高画質, 標準画質)。30fpsまでの値
+    # 参考: https://support.google.com/youtube/answer/1722171
+    QUALITY_BITRATES = (
+        (2160, 35000, 20000, 13000),  # 4K
+        (1440, 16000, 10000, 6000),   # 2K
+        (1080, 8000, 5000, 3000),     # Full HD
+        (720, 5000, 2500, 1500),      # HD
+        (480, 2500, 1000, 500),       # SD
+        (0, 1000, 500, 250),
+    )
+    # 推奨ビットレートの基準フレームレート (これより速い動画は比例して増やす)
+    QUALITY_BASE_FPS = 30
+    
+    # 1パスCRFエンコードの設定
+    CRF_VALUE = 23
+    # CRF 0 相当の 1ピクセルあたりビット数 (CRFが1上がるごとに約6.5%減る)
+    CRF_BASE_BPP = 0.32
+    
+    def __init__(self, dry_run: bool = False, quiet: bool = False, strict_size: bool = False,
+                 max_parallel: Optional[int] = None, encoder: str = 'auto'):
         self.input_files: List[Path] = []
         self.target_size_mb: Optional[float] = None
         self.output_format: Optional[str] = None
         self.batch_mode: bool = False
         self.dry_run: bool = dry_run
+        # 目標サイズに厳密に合わせる(libx264の2パス)。Falseなら1パスCRFで目標サイズを上限にする
+        self.strict_size: bool = strict_size
+        # 並列ワーカー内では進捗表示を出さない(出力が混ざるため)
+        self.quiet: bool = quiet
+        # 使う映像エンコーダー ('auto' なら使えるハードウェアエンコーダーを探し、なければlibx264)
+        self.preferred_encoder: str = encoder
+        self._encoder: Optional[str] = None
+        # check_ffmpeg() でフルパスに置き換わる
+        self._ffmpeg_bin: str = 'ffmpeg'
+        self._ffprobe_bin: str = 'ffprobe'
+        # バッチ処理の最大並列数 (Noneならコア数から自動で決める)
+        self.max_parallel: Optional[int] = max_parallel
+        # 同時に動かすffmpegの数 (compress_many() が設定し、スレッド数をその分だけ割る)
+        self._parallel_jobs: int = 1
+        # 最後に描画した進捗 (0.5%刻み)
+        self._last_prog: int = -1
+        # ディレクトリ走査時に取得した入力ファイルのサイズ(バイト)
+        self._input_sizes: Dict[Path, int] = {}
+        # 動画情報のプロセス内キャッシュ ((パス, サイズ, 更新時刻) -> 動画情報、古い順)
+        self._probe_memo: 'OrderedDict[tuple, dict]' = OrderedDict()
+        # 動画情報から取り出した VideoMeta (id(動画情報) -> (動画情報, VideoMeta)、古い順)
+        # 動画情報も一緒に持っておき、id が別のオブジェクトに使い回されないようにする
+        self._meta_memo: 'OrderedDict[int, Tuple[dict, VideoMeta]]' = OrderedDict()
+        # SIZE_RATIO_FILE の内容 (初回参照時に読み込む)
+        self._size_ratios: Optional[Dict[str, float]] = None
+        # 出力ファイル名に使うタイムスタンプ (run() ごとに更新)
+        self._run_timestamp: str = datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
     
     def check_ffmpeg(self) -> bool:
-        """ffmpegがインストールされているか確認"""
+        """ffmpeg/ffprobeがインストールされているか確認
+        
+        見つかった実行ファイルのパスを保持し、以降の起動でPATH探索を省く
+        """
+        ffmpeg_bin = shutil.which('ffmpeg')
+        ffprobe_bin = shutil.which('ffprobe')
+        if ffmpeg_bin is None or ffprobe_bin is None:
+            return False
+        
+        self._ffmpeg_bin = ffmpeg_bin
+        self._ffprobe_bin = ffprobe_bin
+        return True
+    
+    def _detect_encoder(self) -> str:
+        """使用するH.264エンコーダーを判定(結果はキャッシュ)
+        
+        ハードウェアエンコーダーが使えればそれを優先し、なければlibx264
+        """
+        if self._encoder is not None:
+            return self._encoder
+        
+        self._encoder = 'libx264'
         try:
-            subprocess.run(
-                ['ffmpeg', '-version'], 
-                stdout=subprocess.PIPE, 
-                stderr=subprocess.PIPE,
-                check=True
+            result = subprocess.run(
+                [self._ffmpeg_bin, '-hide_banner', '-encoders'],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True
             )
-            return True
         except (subprocess.CalledProcessError, FileNotFoundError):
-            return False
+            return self._encoder
+        
+        available = set()
+        for line in result.stdout.splitlines():
+            fields = line.split()
+            if len(fields) >= 2:
+                available.add(fields[1])
+        
+        # 一覧に載っていても対応ハードウェアがない場合があるので、短い試しエンコードで確認
+        for encoder in self.HW_ENCODERS:
+            if encoder not in available:
+                continue
+            test_cmd = (
+                [self._ffmpeg_bin, '-hide_banner']
+                + self._hw_input_args(encoder)
+                + ['-f', 'lavfi', '-i', 'color=black:s=256x256:d=0.1']
+                + self._hw_encode_args(encoder, 1000)
+                + ['-f', 'null', '-']
+            )
+            # 成否だけ分かればいいので、出力はパイプに溜めずに捨てる
+            try:
+                subprocess.run(test_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                               check=True)
+            except (subprocess.CalledProcessError, FileNotFoundError):
+                continue
+            self._encoder = encoder
+            break
+        
+        return self._encoder
+    
+    def _video_encoder(self) -> str:
+        """実際に使う映像エンコーダー (厳密なサイズ指定時は2パスのためlibx264)
+        
+        自動判定 (_detect_encoder) は初めて必要になったときだけ行う
+        """
+        if self.strict_size:
+            return 'libx264'
+        if self.preferred_encoder != 'auto':
+            return self.preferred_encoder
+        return self._detect_encoder()
+    
+    def _hw_input_args(self, encoder: str) -> List[str]:
+        """ハードウェアエンコーダー用の入力前オプション"""
+        if encoder == 'h264_vaapi':
+            return ['-vaapi_device', self.VAAPI_DEVICE]
+        return []
+    
+    def _hw_encode_args(self, encoder: str, video_bitrate: int) -> List[str]:
+        """ハードウェアエンコーダー用の映像エンコードオプション(1パスVBR)"""
+        args = ['-c:v', encoder]
+        if encoder == 'h264_vaapi':
+            args += ['-vf', 'format=nv12,hwupload']
+        if encoder == 'h264_nvenc':
+            args += ['-rc', 'vbr']
+        args += [
+            '-b:v', f'{video_bitrate}k',
+            '-maxrate', f'{int(video_bitrate * 1.5)}k',
+            '-bufsize', f'{2 * video_bitrate}k',
+        ]
+        if encoder == 'h264_qsv':
+            args += ['-look_ahead', '1']
+        return args
     
     def get_video_files_from_directory(self, directory: Path) -> List[Path]:
         """ディレクトリ内の全動画ファイルを取得"""
+        # scandir は d_type を持っているので、通常ファイルなら追加の stat が不要
         video_files = []
-        for file_path in directory.iterdir():
-            if file_path.is_file() and file_path.suffix.lower() in self.SUPPORTED_FORMATS:
-                video_files.append(file_path)
+        with os.scandir(directory) as it:
+            for entry in it:
+                stem, dot, ext = entry.name.rpartition('.')
+                if dot and stem and ext.lower() in self._SUFFIX_SET and entry.is_file():
+                    path = Path(entry.path)
+                    # DirEntry は stat 結果を保持するので、一覧表示などで使い回す
+                    self._input_sizes[path] = entry.stat().st_size
+                    video_files.append(path)
         return sorted(video_files)
     
     def get_video_info(self, video_path: Path) -> dict:
+        """動画情報を取得 (PyAVがあればそれを、なければffprobeを使う)
+        
+        結果はパス・サイズ・更新時刻をキーにメモリとディスクにキャッシュし、
+        同じファイルを繰り返し圧縮するときはプローブを省く
+        """
+        resolved = video_path.resolve()
+        st = resolved.stat()
+        key = (str(resolved), st.st_size, int(st.st_mtime))
+        
+        video_info = self._probe_memo.get(key)
+        if video_info is not None:
+            self._probe_memo.move_to_end(key)
+            return video_info
+        
+        sidecar = self.PROBE_CACHE_DIR / f"{hashlib.sha1(key[0].encode()).hexdigest()}.json"
+        video_info = self._load_probe_cache(sidecar, key)
+        if video_info is None:
+            video_info = self._probe(video_path)
+            self._save_probe_cache(sidecar, key, video_info)
+        
+        self._probe_memo[key] = video_info
+        if len(self._probe_memo) > self.PROBE_MEMO_SIZE:
+            self._probe_memo.popitem(last=False)
+        return video_info
+    
+    def video_meta(self, video_info: dict) -> VideoMeta:
+        """動画情報から計算に使う値を取り出す (同じ動画情報なら2回目以降は使い回す)"""
+        cached = self._meta_memo.get(id(video_info))
+        if cached is not None and cached[0] is video_info:
+            return cached[1]
+        
+        video_stream = self._get_video_stream(video_info) or {}
+        try:
+            num, _, den = video_stream.get('r_frame_rate', '0/1').partition('/')
+            fps = float(num) / float(den or 1)
+        except (ValueError, ZeroDivisionError):
+            fps = 0.0
+        try:
+            v_bitrate = int(video_stream.get('bit_rate', 0)) // 1000
+        except ValueError:
+            v_bitrate = 0
+        
+        meta = VideoMeta(
+            duration=float(video_info['format']['duration']),
+            codec=video_stream.get('codec_name') or '',
+            width=video_stream.get('width', 0),
+            height=video_stream.get('height', 0),
+            fps=fps,
+            v_bitrate=v_bitrate,
+        )
+        self._meta_memo[id(video_info)] = (video_info, meta)
+        if len(self._meta_memo) > self.PROBE_MEMO_SIZE:
+            self._meta_memo.popitem(last=False)
+        return meta
+    
+    def _probe(self, video_path: Path) -> dict:
+        """キャッシュを使わずに動画情報を取得"""
+        if av is not None:
+            try:
+                return self._probe_with_av(video_path)
+            except Exception:
+                # PyAVで読めないファイルはffprobeに任せる
+                pass
+        return self._probe_with_ffprobe(video_path)
+    
+    def _load_probe_cache(self, sidecar: Path, key: tuple) -> Optional[dict]:
+        """ディスクの動画情報キャッシュを読む (キーが違えば None)"""
+        try:
+            with open(sidecar, 'rb') as f:
+                cached = _json_loads(f.read())
+        except (OSError, ValueError):
+            return None
+        if tuple(cached.get('key', ())) != key:
+            return None
+        # 最近使ったキャッシュとして更新日時を記録(LRU削除の対象から外す)
+        try:
+            os.utime(sidecar)
+        except OSError:
+            pass
+        return cached.get('info')
+    
+    def _save_probe_cache(self, sidecar: Path, key: tuple, video_info: dict):
+        """動画情報をディスクにキャッシュ (書き込み途中のファイルを読まないよう置き換えで保存)
+        
+        _probe_all() は複数スレッドで同じファイルを調べることもあるので、一時ファイルは
+        呼び出しごとに別の名前にする
+        """
+        tmp_path = None
+        try:
+            sidecar.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=sidecar.parent,
+                                             prefix=f'{sidecar.stem}.', suffix='.tmp',
+                                             delete=False) as f:
+                tmp_path = f.name
+                json.dump({'key': list(key), 'info': video_info}, f)
+            os.replace(tmp_path, sidecar)
+        except OSError:
+            if tmp_path is not None:
+                Path(tmp_path).unlink(missing_ok=True)
+    
+    def _evict_probe_cache(self):
+        """動画情報キャッシュが上限件数を超えたら、古いものから削除
+        
+        全件を調べるので保存のたびではなく、run() / run_batch() の最初に1回だけ呼ぶ
+        """
+        try:
+            entries = [(entry.stat().st_mtime, entry)
+                       for entry in self.PROBE_CACHE_DIR.iterdir() if entry.is_file()]
+        except OSError:
+            return
+        if len(entries) <= self.PROBE_CACHE_LIMIT:
+            return
+        
+        entries.sort()
+        for _, entry in entries[:len(entries) - self.PROBE_CACHE_LIMIT]:
+            entry.unlink(missing_ok=True)
+    
+    def _probe_with_av(self, video_path: Path) -> dict:
+        """PyAVで動画情報を取得 (ffprobe の JSON と同じ形で返す)"""
+        with av.open(str(video_path)) as container:
+            if container.duration is None:
+                raise ValueError("duration が取得できない")
+            
+            streams = []
+            for stream in container.streams:
+                codec_context = stream.codec_context
+                info = {
+                    'codec_type': stream.type,
+                    'codec_name': codec_context.name if codec_context else None,
+                }
+                if stream.bit_rate:
+                    info['bit_rate'] = str(stream.bit_rate)
+                if stream.type == 'video':
+                    rate = stream.base_rate or stream.average_rate
+                    info['width'] = codec_context.width
+                    info['height'] = codec_context.height
+                    info['r_frame_rate'] = f"{rate.numerator}/{rate.denominator}" if rate else '0/1'
+                streams.append(info)
+            
+            return {
+                'format': {'duration': str(container.duration / 1_000_000)},
+                'streams': streams,
+            }
+    
+    def _probe_with_ffprobe(self, video_path: Path) -> dict:
         """ffprobeで動画情報を取得"""
         try:
             cmd = [
-                'ffprobe',
+                self._ffprobe_bin,
                 '-v', 'quiet',
-                '-print_format', 'json',
-                '-show_format',
-                '-show_streams',
+                # 改行とインデントを省いた JSON にして、出力とパースの量を減らす
+                '-print_format', 'json=compact=1',
+                # 使う項目だけ出力させる (音声のコピー判定に音声ストリームも要る)
+                '-show_entries',
+                'format=duration:stream=codec_type,codec_name,width,height,r_frame_rate,bit_rate',
                 str(video_path)
             ]
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-            return json.loads(result.stdout)
+            result = subprocess.run(cmd, capture_output=True, check=True)
+            return _json_loads(result.stdout)
         except subprocess.CalledProcessError as e:
             raise RuntimeError(f"動画情報の取得に失敗したわ: {e}")
-        except json.JSONDecodeError:
+        except ValueError:
             raise RuntimeError("動画情報のパースに失敗。ファイルが壊れてるかも")
     
     def get_file_size_mb(self, file_path: Path) -> float:
@@ -86,61 +453,210 @@ class VideoCompressor:
         size_bytes = file_path.stat().st_size
         return size_bytes / (1024 * 1024)
     
-    def calculate_bitrate(self, target_size_mb: float, duration: float, audio_bitrate: int = 192) -> int:
-        """目標ファイルサイズから必要なビデオビットレートを計算"""
+    def _input_size_mb(self, input_path: Path) -> float:
+        """入力ファイルのサイズをMB単位で取得(走査時のサイズがあればそれを使う)"""
+        size_bytes = self._input_sizes.get(input_path)
+        if size_bytes is None:
+            return self.get_file_size_mb(input_path)
+        return size_bytes / (1024 * 1024)
+    
+    def calculate_bitrate(self, target_size_mb: float, duration: float, audio_bitrate: int = 192,
+                          size_ratio: Optional[float] = None,
+                          audio_bits: Optional[float] = None) -> int:
+        """目標ファイルサイズから必要なビデオビットレートを計算
+        
+        size_ratio: 実際の映像サイズ / 指定ビットレートから求めたサイズ の見込み
+                    (Noneなら DEFAULT_SIZE_RATIO)。サイズはビットレートに比例するので、
+                    予測を目標に合わせる逆算は1回の割り算で済む
+        audio_bits: 音声全体のビット数 (音声をコピーする場合の実サイズ。Noneなら audio_bitrate から計算)
+        """
+        if size_ratio is None:
+            size_ratio = self.DEFAULT_SIZE_RATIO
+        
         target_size_bits = target_size_mb * 8 * 1024 * 1024
-        audio_bitrate_bps = audio_bitrate * 1000
-        audio_total_bits = audio_bitrate_bps * duration
+        if audio_bits is None:
+            audio_bitrate_bps = audio_bitrate * 1000
+            audio_total_bits = audio_bitrate_bps * duration
+        else:
+            audio_total_bits = audio_bits
         video_total_bits = target_size_bits - audio_total_bits
         
         if video_total_bits <= 0:
             raise ValueError("目標サイズが小さすぎる。音声だけで容量オーバーするわ")
         
         video_bitrate_bps = video_total_bits / duration
-        return int(video_bitrate_bps / 1000 * 0.95)
+        video_bitrate = int(video_bitrate_bps / 1000 / size_ratio)
+        return video_bitrate
     
-    def estimate_quality_level(self, video_bitrate: int, video_info: dict) -> str:
-        """ビットレートから予想画質レベルを判定"""
-        # 動画ストリームを取得
-        video_stream = None
+    def _quality_bitrates(self, video_info: dict) -> Tuple[int, int, int]:
+        """この動画の解像度・フレームレートでの推奨ビットレート kbps (最高画質, 高画質, 標準画質)"""
+        meta = self.video_meta(video_info)
+        scale = max(1.0, meta.fps / self.QUALITY_BASE_FPS)
+        for min_height, excellent, good, acceptable in self.QUALITY_BITRATES:
+            if meta.height >= min_height:
+                return int(excellent * scale), int(good * scale), int(acceptable * scale)
+        return 0, 0, 0
+    
+    def _bitrate_cap(self, video_info: dict) -> Optional[int]:
+        """ビットレートの上限 kbps (最高画質の推奨値。これ以上使っても画質はほぼ変わらない)
+        
+        厳密サイズモードは目標サイズちょうどを狙うので上限なし (None)
+        """
+        if self.strict_size or not self.video_meta(video_info).codec:
+            return None
+        return self._quality_bitrates(video_info)[0] or None
+    
+    def _target_video_bitrate(self, video_info: dict, target_size_mb: float,
+                              audio_bitrate: int = 192,
+                              audio_bits: Optional[float] = None) -> Tuple[int, int]:
+        """この動画で目標サイズに収めるビデオビットレートを計算
+        
+        学習したサイズ比率を使い、解像度に対する上限 (_bitrate_cap) もかける。
+        戻り値: (使うビットレート, 上限をかける前のビットレート) kbps
+        """
+        meta = self.video_meta(video_info)
+        budget = self.calculate_bitrate(target_size_mb, meta.duration, audio_bitrate,
+                                        size_ratio=self._size_ratio(video_info),
+                                        audio_bits=audio_bits)
+        cap = self._bitrate_cap(video_info)
+        return (min(budget, cap) if cap else budget), budget
+    
+    def _describe_video_bitrate(self, video_bitrate: int, budget_bitrate: int) -> str:
+        """レポート用のビデオビットレートの説明 (解像度の上限がかかったらそう書く)"""
+        if video_bitrate < budget_bitrate:
+            return (f"{video_bitrate} kbps (解像度に対する上限。目標サイズからは "
+                    f"{budget_bitrate} kbps まで使える)")
+        return f"{video_bitrate} kbps"
+    
+    def _resolution_bucket(self, video_info: dict) -> str:
+        """サイズ比率の学習に使う解像度帯"""
+        height = self.video_meta(video_info).height
+        for threshold in (2160, 1440, 1080, 720, 480):
+            if height >= threshold:
+                return f"{threshold}p"
+        return "low"
+    
+    def _size_ratio_key(self, video_info: dict) -> str:
+        """サイズ比率の学習キー (エンコーダーごとに傾向が違うので分ける)"""
+        return f"{self._video_encoder()}:{self._resolution_bucket(video_info)}"
+    
+    def _load_size_ratios(self) -> Dict[str, float]:
+        """学習済みのサイズ比率を読み込む"""
+        if self._size_ratios is None:
+            try:
+                with open(self.SIZE_RATIO_FILE, encoding='utf-8') as f:
+                    self._size_ratios = json.load(f)
+            except (OSError, ValueError):
+                self._size_ratios = {}
+        return self._size_ratios
+    
+    def _size_ratio(self, video_info: dict) -> float:
+        """この動画で見込むサイズ比率 (学習データがなければ既定値)
+        
+        学習は目標サイズを超えないよう予算を絞る方向にだけ効かせ、既定値より小さくはしない
+        """
+        learned = self._load_size_ratios().get(self._size_ratio_key(video_info))
+        if learned is None:
+            return self.DEFAULT_SIZE_RATIO
+        return max(learned / self.SIZE_SAFETY_MARGIN, self.DEFAULT_SIZE_RATIO)
+    
+    def _record_size_ratio(self, video_info: dict, video_bitrate: int, final_size_mb: float,
+                           audio_bits: float):
+        """エンコード結果からサイズ比率を学習し、次回のビットレート計算に反映"""
+        duration = self.video_meta(video_info).duration
+        predicted_bits = video_bitrate * 1000 * duration
+        actual_bits = final_size_mb * 8 * 1024 * 1024 - audio_bits
+        if predicted_bits <= 0 or actual_bits <= 0:
+            return
+        
+        observed = actual_bits / predicted_bits
+        # 極端な値(VFRの誤検出など)で学習が壊れないようにする
+        if not 0.5 <= observed <= 2.0:
+            return
+        # 学習するのは超過だけ。小さく出たのは動きの少ない動画を埋めきれなかっただけのことが多く、
+        # 次のファイルのビットレートを上げる理由にはならない
+        observed = max(observed, 1.0)
+        
+        ratios = self._load_size_ratios()
+        key = self._size_ratio_key(video_info)
+        previous = ratios.get(key)
+        ratios[key] = observed if previous is None else previous * 0.7 + observed * 0.3
+        
+        try:
+            self.SIZE_RATIO_FILE.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.SIZE_RATIO_FILE.with_suffix('.json.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(ratios, f)
+            os.replace(tmp_path, self.SIZE_RATIO_FILE)
+        except OSError:
+            pass
+    
+    def _get_video_stream(self, video_info: dict) -> Optional[dict]:
+        """ffprobeの結果から最初の動画ストリームを取得"""
         for stream in video_info.get('streams', []):
             if stream.get('codec_type') == 'video':
-                video_stream = stream
-                break
+                return stream
+        return None
+    
+    def _get_audio_stream(self, video_info: dict) -> Optional[dict]:
+        """ffprobeの結果から最初の音声ストリームを取得"""
+        for stream in video_info.get('streams', []):
+            if stream.get('codec_type') == 'audio':
+                return stream
+        return None
+    
+    def _pick_audio_args(self, video_info: dict, audio_bitrate: int,
+                         output_format: str) -> Tuple[List[str], float]:
+        """音声のエンコードオプションと、音声全体のビット数を決める
         
-        if not video_stream:
-            return "不明"
+        元がAAC かつ audio_bitrate 以下なら再エンコードせずコピーする
+        (再エンコードしても音質が落ちるだけなので)
+        """
+        duration = self.video_meta(video_info).duration
+        audio_stream = self._get_audio_stream(video_info)
+        if audio_stream is None:
+            return ['-c:a', 'aac', '-b:a', f'{audio_bitrate}k'], 0.0
+        
+        try:
+            source_bitrate = int(audio_stream.get('bit_rate', 0))
+        except ValueError:
+            source_bitrate = 0
+        
+        if (audio_stream.get('codec_name') == 'aac'
+                and 0 < source_bitrate <= audio_bitrate * 1000
+                and output_format.lower() in self.AAC_COPY_FORMATS):
+            return ['-c:a', 'copy'], source_bitrate * duration
+        
+        return ['-c:a', 'aac', '-b:a', f'{audio_bitrate}k'], audio_bitrate * 1000 * duration
+    
+    def _describe_audio(self, audio_args: List[str], audio_bits: float, duration: float,
+                        audio_bitrate: int) -> str:
+        """レポート用の音声設定の説明"""
+        if audio_args[1] == 'copy':
+            return f"{int(audio_bits / duration / 1000)} kbps (元のAACをそのままコピー)"
+        return f"{audio_bitrate} kbps (AAC)"
+    
+    def _estimate_crf_bitrate(self, video_info: dict, crf: Optional[int] = None) -> int:
+        """CRFエンコード時のおおよそのビデオビットレート(kbps)を推定
+        
+        bitrate ≈ base_bpp * width * height * fps * exp(-0.065 * crf)
+        解像度やフレームレートが取れない場合は0を返す
+        """
+        if crf is None:
+            crf = self.CRF_VALUE
         
-        # 解像度取得
-        width = video_stream.get('width', 0)
-        height = video_stream.get('height', 0)
+        meta = self.video_meta(video_info)
+        bits_per_second = (self.CRF_BASE_BPP * meta.width * meta.height * meta.fps
+                           * math.exp(-0.065 * crf))
+        return int(bits_per_second / 1000)
+    
+    def estimate_quality_level(self, video_bitrate: int, video_info: dict) -> str:
+        """ビットレートから予想画質レベルを判定"""
+        if not self.video_meta(video_info).codec:
+            return "不明"
         
         # 解像度ベースの推奨ビットレート(kbps)
-        # 参考: https://support.google.com/youtube/answer/1722171
-        if height >= 2160:  # 4K
-            excellent = 35000
-            good = 20000
-            acceptable = 13000
-        elif height >= 1440:  # 2K
-            excellent = 16000
-            good = 10000
-            acceptable = 6000
-        elif height >= 1080:  # Full HD
-            excellent = 8000
-            good = 5000
-            acceptable = 3000
-        elif height >= 720:  # HD
-            excellent = 5000
-            good = 2500
-            acceptable = 1500
-        elif height >= 480:  # SD
-            excellent = 2500
-            good = 1000
-            acceptable = 500
-        else:
-            excellent = 1000
-            good = 500
-            acceptable = 250
+        excellent, good, acceptable = self._quality_bitrates(video_info)
         
         # 判定
         if video_bitrate >= excellent:
@@ -153,115 +669,391 @@ class VideoCompressor:
             return "⚠️  低画質 (明らかに劣化)"
     
     def compress_video(self, input_path: Path, output_path: Path, video_bitrate: int, 
-                      video_info: dict, current: int = 1, total: int = 1, audio_bitrate: int = 192):
-        """動画を圧縮(2パスエンコーディング)"""
+                      video_info: dict, current: int = 1, total: int = 1, audio_bitrate: int = 192,
+                      threads: int = 0, use_crf: bool = True,
+                      budget_bitrate: Optional[int] = None):
+        """動画を圧縮
         
-        if total > 1:
-            print(f"\n🎬 [{current}/{total}] {input_path.name} を圧縮中...")
-        else:
-            print(f"\n🎬 圧縮中です...")
-        print("=" * 60)
+        threads: ffmpegの使用スレッド数 (0なら _ffmpeg_threads())。並列実行時の過剰なスレッド生成を防ぐ
+        use_crf: 1パスCRFで圧縮し、目標ビットレートは上限として使う。
+                 Falseなら目標サイズに厳密に合わせる2パスエンコーディング
+        budget_bitrate: 解像度の上限をかける前のビットレート (映像コピーの判定に使う。Noneなら video_bitrate)
+        戻り値: 使ったレート制御 ('2pass', 'crf', 'hw', 'copy')
+        """
+        if threads <= 0:
+            threads = self._ffmpeg_threads()
         
-        # 1パス目
-        print("\n[1/2] 1パス目: ビットレート解析中...")
-        pass1_cmd = [
-            'ffmpeg',
-            '-i', str(input_path),
-            '-c:v', 'libx264',
-            '-b:v', f'{video_bitrate}k',
-            '-pass', '1',
-            '-an',
-            '-f', 'null',
-            '-y',
-            '/dev/null' if sys.platform != 'win32' else 'NUL'
-        ]
+        if not self.quiet:
+            if total > 1:
+                print(f"\n🎬 [{current}/{total}] {input_path.name} を圧縮中...")
+            else:
+                print(f"\n🎬 圧縮中です...")
+            print("=" * 60)
         
-        try:
-            self._run_ffmpeg_with_progress(pass1_cmd, "1パス目", video_info)
-        except subprocess.CalledProcessError as e:
-            raise RuntimeError(f"1パス目のエンコードに失敗: {e}")
+        # 元の映像とほぼ同じビットレートまで使えるなら、再エンコードしても画質は上がらない
+        if self._can_copy_video(video_info, budget_bitrate or video_bitrate, output_path.suffix[1:]):
+            self._remux_only(input_path, output_path, video_info, audio_bitrate)
+            return 'copy'
+        
+        # ハードウェアエンコーダーは独自の先読みを持つので1パスで十分
+        encoder = self._video_encoder()
+        if encoder != 'libx264':
+            self._compress_hardware(input_path, output_path, video_bitrate, video_info,
+                                    encoder, audio_bitrate)
+            return 'hw'
+        
+        # 「N MB以下に収める」だけなら、CRF + VBV上限の1パスで足りる(1パス目の解析が不要)
+        if use_crf:
+            self._compress_single_pass(input_path, output_path, video_bitrate, video_info,
+                                       audio_bitrate, threads)
+            return 'crf'
+        
+        # 1パス目の解析結果は入力ファイルだけで決まるので、ファイルごとにキャッシュして使い回す
+        # (ジョブごとに別ディレクトリになるため、並列実行時も ffmpeg2pass-0.log が衝突しない)
+        cache_dir = self._passlog_cache_dir(input_path)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        # 最近使ったキャッシュとして更新日時を記録(LRU削除の対象から外す)
+        os.utime(cache_dir)
+        passlog = str(cache_dir / 'pass')
+        # ログはmbtree → logの順に置くので、logがあれば2つともそろっている
+        cached = (cache_dir / 'pass-0.log').exists() and (cache_dir / 'pass-0.log.mbtree').exists()
+        
+        # 1パス目
+        if cached:
+            if not self.quiet:
+                print("\n[1/2] 1パス目: 前回の解析結果を再利用します")
+        else:
+            if not self.quiet:
+                print("\n[1/2] 1パス目: ビットレート解析中...")
+            # 中断されたり失敗した1パス目のログがキャッシュに残らないよう、一時ディレクトリに書かせて
+            # 成功したときだけキャッシュへ移す
+            work_dir = Path(tempfile.mkdtemp(prefix='pass-', dir=self._passlog_work_root()))
+            work_passlog = str(work_dir / 'pass')
+            pass1_cmd = [
+                self._ffmpeg_bin,
+                '-i', str(input_path),
+                '-c:v', 'libx264',
+                '-b:v', f'{video_bitrate}k',
+                '-threads', str(threads),
+                '-pass', '1',
+                '-passlogfile', work_passlog,
+                # 音声はコピーするだけ(ほぼコストなし)。-an だと進捗の再生位置が正しく出ないことがある
+                '-c:a', 'copy',
+                '-f', 'null',
+                '-y',
+                os.devnull
+            ]
+            
+            try:
+                self._run_ffmpeg_with_progress(pass1_cmd, "1パス目", video_info)
+                for suffix in ('-0.log.mbtree', '-0.log'):
+                    os.replace(work_passlog + suffix, passlog + suffix)
+            except subprocess.CalledProcessError as e:
+                raise RuntimeError(f"1パス目のエンコードに失敗: {self._ffmpeg_error_message(e)}")
+            except OSError as e:
+                raise RuntimeError(f"1パス目のログが保存できない: {e}")
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
         
         # 2パス目
-        print("\n[2/2] 2パス目: 最終エンコード中...")
+        if not self.quiet:
+            print("\n[2/2] 2パス目: 最終エンコード中...")
+        audio_args, _ = self._pick_audio_args(video_info, audio_bitrate, output_path.suffix[1:])
         pass2_cmd = [
-            'ffmpeg',
+            self._ffmpeg_bin,
             '-i', str(input_path),
             '-c:v', 'libx264',
             '-b:v', f'{video_bitrate}k',
+            '-threads', str(threads),
             '-pass', '2',
-            '-c:a', 'aac',
-            '-b:a', f'{audio_bitrate}k',
+            '-passlogfile', passlog,
+        ] + audio_args + self._container_args(output_path) + [
             '-y',
             str(output_path)
         ]
         
         try:
             self._run_ffmpeg_with_progress(pass2_cmd, "2パス目", video_info)
+        except BaseException as e:
+            # キャッシュしたログが原因で失敗することもあるので、次回は1パス目からやり直す
+            # (Ctrl+C などで中断されたときも同じ)
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            if isinstance(e, subprocess.CalledProcessError):
+                raise RuntimeError(f"2パス目のエンコードに失敗: {self._ffmpeg_error_message(e)}")
+            raise
+        
+        # 上限を超えた古いキャッシュを削除
+        self._evict_passlog_cache(keep=cache_dir)
+        return '2pass'
+    
+    def _ffmpeg_threads(self) -> int:
+        """1つのffmpegに割り当てるスレッド数
+        
+        libx264の自動設定(コア数の約1.5倍)は、複数のffmpegを同時に動かすと
+        スレッドが余って取り合いになるので、同時実行数でコアを分ける
+        """
+        cores = os.cpu_count() or 4
+        return max(1, cores // max(1, self._parallel_jobs))
+    
+    def _can_copy_video(self, video_info: dict, video_bitrate: int, output_format: str) -> bool:
+        """映像を再エンコードせずにコピーしても目標サイズに収まるか"""
+        if output_format.lower() not in self.H264_COPY_FORMATS:
+            return False
+        meta = self.video_meta(video_info)
+        if meta.codec != 'h264':
+            return False
+        return meta.v_bitrate > 0 and video_bitrate >= meta.v_bitrate * self.VIDEO_COPY_MIN_RATIO
+    
+    def _remux_only(self, input_path: Path, output_path: Path, video_info: dict,
+                    audio_bitrate: int = 192):
+        """映像はそのままコピーし、音声とコンテナだけ作り直す"""
+        if not self.quiet:
+            print("\n[1/1] 映像はそのままコピーします (再エンコードなし)...")
+        cmd = [
+            self._ffmpeg_bin,
+            '-i', str(input_path),
+            '-c:v', 'copy',
+        ] + self._pick_audio_args(video_info, audio_bitrate, output_path.suffix[1:])[0]
+        cmd += self._container_args(output_path) + ['-y', str(output_path)]
+        
+        try:
+            self._run_ffmpeg_with_progress(cmd, "コピー", video_info)
         except subprocess.CalledProcessError as e:
-            raise RuntimeError(f"2パス目のエンコードに失敗: {e}")
+            raise RuntimeError(f"コピーに失敗: {self._ffmpeg_error_message(e)}")
+    
+    def _container_args(self, output_path: Path) -> list:
+        """出力コンテナ用のffmpeg引数
         
-        self._cleanup_ffmpeg_logs()
+        MP4/MOVは書き出しの最後に moov を先頭へ移し、再生開始やシークを速くする
+        (後から別途書き直す必要がない)
+        """
+        if output_path.suffix[1:].lower() in self.FASTSTART_FORMATS:
+            return ['-movflags', '+faststart']
+        return []
+    
+    def _compress_hardware(self, input_path: Path, output_path: Path, video_bitrate: int,
+                           video_info: dict, encoder: str, audio_bitrate: int = 192):
+        """ハードウェアエンコーダーで1パス圧縮"""
+        if not self.quiet:
+            print(f"\n[1/1] ハードウェアエンコード中 ({encoder})...")
+        cmd = (
+            [self._ffmpeg_bin]
+            + self._hw_input_args(encoder)
+            + ['-i', str(input_path)]
+            + self._hw_encode_args(encoder, video_bitrate)
+            + self._pick_audio_args(video_info, audio_bitrate, output_path.suffix[1:])[0]
+            + self._container_args(output_path)
+            + ['-y', str(output_path)]
+        )
+        
+        try:
+            self._run_ffmpeg_with_progress(cmd, "エンコード", video_info)
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"エンコードに失敗: {self._ffmpeg_error_message(e)}")
+    
+    def _compress_single_pass(self, input_path: Path, output_path: Path, video_bitrate: int,
+                              video_info: dict, audio_bitrate: int = 192, threads: int = 0):
+        """1パスCRFで圧縮(ビットレートの上限はVBVで目標値に抑える)"""
+        if not self.quiet:
+            print(f"\n[1/1] CRF {self.CRF_VALUE} で1パスエンコード中...")
+        cmd = [
+            self._ffmpeg_bin,
+            '-i', str(input_path),
+            '-c:v', 'libx264',
+            '-crf', str(self.CRF_VALUE),
+            '-maxrate', f'{video_bitrate}k',
+            '-bufsize', f'{2 * video_bitrate}k',
+            '-threads', str(threads),
+        ] + self._pick_audio_args(video_info, audio_bitrate, output_path.suffix[1:])[0]
+        cmd += self._container_args(output_path) + ['-y', str(output_path)]
+        
+        try:
+            self._run_ffmpeg_with_progress(cmd, "エンコード", video_info)
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"エンコードに失敗: {self._ffmpeg_error_message(e)}")
     
     def _run_ffmpeg_with_progress(self, cmd: list, phase: str, video_info: dict):
-        """ffmpegを実行し、進捗を表示"""
+        """ffmpegを実行し、進捗を表示
+        
+        進捗は -progress pipe:1 で標準出力に出る key=value 形式の行から読み取る。
+        パイプはまとめて読み、1回の読み込みにつき最後の進捗だけを描画する
+        """
+        # -nostats と -loglevel error で stderr の人間向け出力を止め、機械向けの -progress だけにする
+        # (stderr にはエラーだけが残る)
+        cmd = [cmd[0], '-progress', 'pipe:1', '-nostats', '-loglevel', 'error'] + cmd[1:]
         process = subprocess.Popen(
             cmd,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            universal_newlines=True
+            bufsize=0
         )
         
-        duration = float(video_info['format']['duration'])
+        # 再生位置(秒) → 進捗(%) の係数。進捗のたびに割り算しないよう1回だけ求める
+        duration = self.video_meta(video_info).duration
+        percent_per_sec = 100.0 / duration if duration > 0 else 0.0
+        self._last_prog = -1
         
-        while True:
-            line = process.stderr.readline()
-            if not line and process.poll() is not None:
-                break
+        out_buffer = bytearray()
+        err_buffer = bytearray()
+        # エラー時に表示するため、stderr は末尾の数行だけ残す
+        stderr_tail: deque = deque(maxlen=20)
+        
+        for is_stdout, data in self._read_pipes(process):
+            if not is_stdout:
+                err_buffer += data
+                *lines, rest = err_buffer.split(b'\n')
+                stderr_tail.extend(lines)
+                err_buffer = bytearray(rest)
+                continue
             
-            time_match = re.search(r'time=(\d{2}):(\d{2}):(\d{2}\.\d{2})', line)
-            if time_match:
-                hours, minutes, seconds = time_match.groups()
-                current_time = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
-                progress = min(100, (current_time / duration) * 100)
-                
-                bar_length = 40
-                filled = int(bar_length * progress / 100)
-                bar = '█' * filled + '░' * (bar_length - filled)
-                
-                if progress > 0:
-                    elapsed = current_time
-                    total_estimated = (elapsed / progress) * 100
-                    remaining = total_estimated - elapsed
-                    remaining_str = self._format_time(remaining)
-                else:
-                    remaining_str = "計算中..."
-                
-                print(f'\r{phase}: [{bar}] {progress:5.1f}% | 残り時間: {remaining_str}', end='', flush=True)
+            out_buffer += data
+            end = out_buffer.rfind(b'\n')
+            if end < 0:
+                continue
+            # 途中の進捗は描画しても上書きされるだけなので、最後の1件だけ見る
+            if not self.quiet:
+                matches = self._OUT_TIME_RE.findall(out_buffer, 0, end)
+                if matches:
+                    current_time = int(matches[-1]) / 1_000_000
+                    self._render_progress(phase, current_time, percent_per_sec)
+            del out_buffer[:end + 1]
         
-        print()
+        if err_buffer:
+            stderr_tail.append(bytes(err_buffer))
+        process.wait()
+        
+        if not self.quiet:
+            print()
         
         if process.returncode != 0:
-            raise subprocess.CalledProcessError(process.returncode, cmd)
+            stderr_text = b'\n'.join(stderr_tail).decode('utf-8', errors='replace').strip()
+            raise subprocess.CalledProcessError(process.returncode, cmd, stderr=stderr_text)
+    
+    def _read_pipes(self, process: subprocess.Popen):
+        """ffmpegの stdout/stderr を届いた分ずつ読み、(stdoutか, データ) を返すジェネレーター
+        
+        POSIXではセレクターでデータが来るまで待つので、空回りしない。
+        Windowsのパイプはセレクターに使えないため、パイプごとのスレッドからキューで受け取る
+        """
+        if sys.platform != 'win32':
+            with selectors.DefaultSelector() as selector:
+                selector.register(process.stdout, selectors.EVENT_READ, True)
+                selector.register(process.stderr, selectors.EVENT_READ, False)
+                while selector.get_map():
+                    for key, _ in selector.select():
+                        # 読めると分かってから読むので、あるだけ返ってきてブロックしない
+                        data = os.read(key.fd, 65536)
+                        if not data:
+                            selector.unregister(key.fileobj)
+                            continue
+                        yield key.data, data
+            return
+        
+        chunks: queue.Queue = queue.Queue()
+        
+        def reader(pipe, is_stdout: bool):
+            for data in iter(lambda: pipe.read(65536), b''):
+                chunks.put((is_stdout, data))
+            chunks.put((is_stdout, b''))
+        
+        for pipe, is_stdout in ((process.stdout, True), (process.stderr, False)):
+            threading.Thread(target=reader, args=(pipe, is_stdout), daemon=True).start()
+        
+        open_pipes = 2
+        while open_pipes:
+            # タイムアウトなしの get() だとWindowsでは Ctrl+C が効かないので、短く区切って待つ
+            try:
+                is_stdout, data = chunks.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if not data:
+                open_pipes -= 1
+                continue
+            yield is_stdout, data
+    
+    def _render_progress(self, phase: str, current_time: float, percent_per_sec: float):
+        """進捗バーを描画 (percent_per_sec: 100 / 動画の長さ)"""
+        progress = min(100, max(0, current_time * percent_per_sec))
+        
+        # 0.5%以上進んだときだけ描画し直す(遅い端末への無駄な書き込みを減らす)
+        prog_step = int(progress * 2)
+        if prog_step == self._last_prog:
+            return
+        self._last_prog = prog_step
+        
+        filled = int(self._BAR_LENGTH * progress / 100)
+        bar = self._BAR_TEMPLATE[self._BAR_LENGTH - filled:2 * self._BAR_LENGTH - filled]
+        
+        if progress > 0:
+            elapsed = current_time
+            total_estimated = (elapsed / progress) * 100
+            remaining = total_estimated - elapsed
+            remaining_str = self._format_time(remaining)
+        else:
+            remaining_str = "計算中..."
+        
+        sys.stdout.write(f'\r{phase}: [{bar}] {progress:5.1f}% | 残り時間: {remaining_str}')
+        sys.stdout.flush()
+    
+    def _ffmpeg_error_message(self, error: subprocess.CalledProcessError) -> str:
+        """ffmpegのエラーを表示用の文字列にする(stderrの末尾があれば付ける)"""
+        if error.stderr:
+            return f"{error}\n{error.stderr}"
+        return str(error)
     
     def _format_time(self, seconds: float) -> str:
         """秒を 'HH:MM:SS' 形式に変換"""
-        hours = int(seconds // 3600)
-        minutes = int((seconds % 3600) // 60)
-        secs = int(seconds % 60)
+        minutes, secs = divmod(int(seconds), 60)
+        hours, minutes = divmod(minutes, 60)
         return f"{hours:02d}:{minutes:02d}:{secs:02d}"
     
-    def _cleanup_ffmpeg_logs(self):
-        """ffmpegの2パスエンコードで生成されるログファイルを削除"""
-        log_files = ['ffmpeg2pass-0.log', 'ffmpeg2pass-0.log.mbtree']
-        for log_file in log_files:
-            try:
-                if os.path.exists(log_file):
-                    os.remove(log_file)
-            except Exception:
-                pass
+    def _passlog_cache_dir(self, input_path: Path) -> Path:
+        """入力ファイルに対応する1パス目ログのキャッシュディレクトリを取得"""
+        st = input_path.stat()
+        key = f"{input_path.resolve()}:{st.st_mtime_ns}:{st.st_size}"
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest()
+        return self.CACHE_DIR / 'passlog' / digest
+    
+    def _evict_passlog_cache(self, keep: Optional[Path] = None):
+        """1パス目ログのキャッシュが上限を超えたら、古いものから削除"""
+        root = self.CACHE_DIR / 'passlog'
+        entries = []
+        total_size = 0
+        try:
+            for entry in root.iterdir():
+                if not entry.is_dir():
+                    continue
+                size = sum(f.stat().st_size for f in entry.iterdir() if f.is_file())
+                entries.append((entry.stat().st_mtime, size, entry))
+                total_size += size
+        except OSError:
+            return
+        
+        entries.sort()
+        for _, size, entry in entries:
+            if total_size <= self.PASSLOG_CACHE_LIMIT:
+                break
+            if entry == keep:
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            total_size -= size
+    
+    def _passlog_work_root(self) -> Path:
+        """1パス目の書き込み中のログを置くディレクトリ
+        
+        キャッシュと同じファイルシステムに置いて os.replace で移せるようにする。
+        キャッシュの削除対象にならないよう、キャッシュとは別のディレクトリにする
+        """
+        root = self.CACHE_DIR / 'passlog-tmp'
+        root.mkdir(parents=True, exist_ok=True)
+        return root
     
     def run(self):
         """メイン処理"""
+        # 出力ファイル名のタイムスタンプは実行ごとに1回だけ取る
+        self._run_timestamp = datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
+        self._evict_probe_cache()
+        
         # フェーズ1: ファイル/ディレクトリパス入力
         self.input_files = self._phase1_get_input_files()
         
@@ -294,7 +1086,7 @@ class VideoCompressor:
         """バッチ処理モード"""
         print(f"\n📁 {len(self.input_files)}個の動画ファイルが見つかりました:")
         for i, file_path in enumerate(self.input_files, 1):
-            size_mb = self.get_file_size_mb(file_path)
+            size_mb = self._input_size_mb(file_path)
             print(f"  {i}. {file_path.name} ({size_mb:.2f} MB)")
         
         # 一括設定 or 個別設定
@@ -348,70 +1140,321 @@ class VideoCompressor:
         else:
             output_format = None
         
-        # 全ファイルを処理
-        total = len(self.input_files)
-        for i, input_path in enumerate(self.input_files, 1):
-            try:
-                video_info = self.get_video_info(input_path)
-                current_format = output_format if output_format else input_path.suffix[1:]
-                
-                if self.dry_run:
+        # ffprobeの起動待ちを隠すため、全ファイルの動画情報を並行して取得しておく
+        probe_futures = self._probe_all(self.input_files)
+        
+        if self.dry_run:
+            total = len(self.input_files)
+            for i, (input_path, probe) in enumerate(zip(self.input_files, probe_futures), 1):
+                try:
+                    video_info = probe.result()
+                    current_format = output_format if output_format else input_path.suffix[1:]
                     self._dry_run_report(input_path, target_size_mb, current_format, 
                                         video_info, current=i, total=total)
-                else:
-                    self._compress_and_report(input_path, target_size_mb, current_format, 
-                                            video_info, current=i, total=total)
-            except Exception as e:
-                print(f"\n❌ エラー: {input_path.name} の処理に失敗: {e}")
-                if not self.dry_run:
-                    continue_choice = input("続けますか？ (y/n): ").strip().lower()
-                    if continue_choice != 'y':
-                        break
+                except Exception as e:
+                    print(f"\n❌ エラー: {input_path.name} の処理に失敗: {e}")
+            print(f"\n✅ ドライラン完了! {total}個のファイルをシミュレートしました。")
+            return
+        
+        self.compress_many(self.input_files, target_size_mb, output_format, probe_futures)
+        print(f"\n🎉 バッチ処理完了! {len(self.input_files)}個のファイルを処理しました。")
+    
+    def _probe_all(self, files: List[Path]) -> list:
+        """全ファイルの動画情報をスレッドで並行して取得し、ファイル順の Future を返す"""
+        probe_executor = ThreadPoolExecutor(max_workers=8)
+        probe_futures = [probe_executor.submit(self.get_video_info, p) for p in files]
+        probe_executor.shutdown(wait=False)
+        return probe_futures
+    
+    def compress_many(self, inputs: List[Path], target_size_mb: float,
+                      output_format: Optional[str] = None,
+                      probe_futures: Optional[list] = None) -> List[Path]:
+        """複数ファイルを同じ設定で並列に圧縮し、出力できたファイルのパスを返す
+        
+        ファイルごとに別プロセスでエンコードする(1パス目のログもファイルごとに別なので衝突しない)。
+        probe_futures: _probe_all() の結果 (Noneならここで取得する)
+        """
+        if probe_futures is None:
+            probe_futures = self._probe_all(inputs)
+        total = len(inputs)
+        
+        # libx264のスレッドは4〜8コアで頭打ちになるため、複数ファイルを同時にエンコードする
+        cores = os.cpu_count() or 1
+        workers = max(1, min(total, self.max_parallel or cores // 2))
+        if self._video_encoder() != 'libx264':
+            workers = min(workers, self.HW_MAX_PARALLEL)
+        # ワーカーに渡るインスタンスにも同時実行数が引き継がれる
+        self._parallel_jobs = workers
+        threads = self._ffmpeg_threads()
+        print(f"\n🚀 {workers}並列でエンコードします (各ffmpeg {threads}スレッド)")
+        
+        # ファイルごとにワーカーへ送るのは設定だけのコピー (self だと入力一覧やキャッシュまで毎回送る)
+        worker_compressor = self._for_worker()
+        outputs: List[Path] = []
+        done = 0
+        executor = ProcessPoolExecutor(max_workers=workers)
+        futures = {}
+        probe_results = {}
+        try:
+            for i, (input_path, probe) in enumerate(zip(inputs, probe_futures), 1):
+                try:
+                    video_info = probe.result()
+                except Exception as e:
+                    done += 1
+                    print(f"\n❌ [{done}/{total}] エラー: {input_path.name} の処理に失敗: {e}")
+                    continue
+                current_format = output_format if output_format else input_path.suffix[1:]
+                future = executor.submit(_encode_one, worker_compressor, input_path,
+                                         target_size_mb, current_format, video_info, 192,
+                                         threads, index=i)
+                futures[future] = input_path
+                probe_results[input_path] = video_info
+            
+            for future in as_completed(futures):
+                input_path = futures[future]
+                done += 1
+                try:
+                    (output_path, final_size, video_bitrate, audio_bits,
+                     rate_control) = future.result()
+                except Exception as e:
+                    print(f"\n❌ [{done}/{total}] エラー: {input_path.name} の処理に失敗: {e}")
+                    continue
+                # 学習結果の書き込みはメインプロセスだけで行う
+                if rate_control in self.SIZE_RATIO_RATE_CONTROLS:
+                    self._record_size_ratio(probe_results[input_path], video_bitrate,
+                                            final_size, audio_bits)
+                outputs.append(output_path)
+                print(f"\n✅ [{done}/{total}] {input_path.name} → {output_path.name}")
+                print(f"  目標サイズ: {target_size_mb:.2f} MB / 実際のサイズ: {final_size:.2f} MB")
+        except BaseException:
+            # Ctrl+C などで止められたら、まだ始まっていないファイルは取り消して待たずに抜ける
+            # (with で抜けると残りのファイルを全部エンコードし終わるまで待ってしまう)
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+            raise
+        executor.shutdown()
+        
+        return outputs
+    
+    def _for_worker(self) -> 'VideoCompressor':
+        """並列ワーカーに渡す、圧縮に必要な設定だけを持ったコピー
+        
+        出力ファイル名のタイムスタンプ、エンコーダー、学習済みのサイズ比率はそのまま引き継ぐ
+        """
+        worker = VideoCompressor(dry_run=self.dry_run, quiet=True, strict_size=self.strict_size,
+                                 max_parallel=self.max_parallel, encoder=self.preferred_encoder)
+        worker._encoder = self._encoder
+        worker._ffmpeg_bin = self._ffmpeg_bin
+        worker._ffprobe_bin = self._ffprobe_bin
+        worker._parallel_jobs = self._parallel_jobs
+        worker._size_ratios = dict(self._load_size_ratios())
+        worker._run_timestamp = self._run_timestamp
+        return worker
+    
+    def compress_one(self, input_path: Path, target_size_mb: float,
+                     output_format: Optional[str] = None, video_info: Optional[dict] = None,
+                     audio_bitrate: int = 192, threads: int = 0,
+                     index: int = 0) -> Tuple[Path, float, int, float, str]:
+        """1ファイルを対話なしで圧縮する
+        
+        output_format: 出力の拡張子 (Noneなら入力と同じ)
+        video_info: 取得済みの動画情報 (Noneならここで取得する)
+        index: バッチ内での番号 (出力ファイル名に付ける。0なら付けない)
+        戻り値: (出力ファイルパス, 実際のサイズMB, ビデオビットレートkbps, 音声全体のビット数, レート制御)
+        """
+        if output_format is None:
+            output_format = input_path.suffix[1:]
+        if video_info is None:
+            video_info = self.get_video_info(input_path)
+        
+        try:
+            _, audio_bits = self._pick_audio_args(video_info, audio_bitrate, output_format)
+            video_bitrate, budget_bitrate = self._target_video_bitrate(
+                video_info, target_size_mb, audio_bitrate, audio_bits)
+        except ValueError as e:
+            raise RuntimeError(f"ビットレート計算エラー: {e}")
+        
+        output_path = self._build_output_path(input_path, target_size_mb, output_format, index)
+        rate_control = self.compress_video(input_path, output_path, video_bitrate, video_info,
+                                           audio_bitrate=audio_bitrate, threads=threads,
+                                           use_crf=not self.strict_size,
+                                           budget_bitrate=budget_bitrate)
+        return (output_path, self.get_file_size_mb(output_path), video_bitrate, audio_bits,
+                rate_control)
+    
+    def input_files_from_args(self, paths: List[str]) -> List[Path]:
+        """コマンドラインで指定されたファイル/ディレクトリから動画ファイルを集める
+        
+        使えないパスはエラーを表示して飛ばす。同じファイルが何度指定されても1回だけ処理する
+        (ディレクトリとその中のファイルを両方指定した場合など)
+        """
+        input_files: List[Path] = []
+        seen = set()
+        
+        def add(path: Path):
+            resolved = path.resolve()
+            if resolved in seen:
+                print(f"⚠️  重複して指定されたので1回だけ処理します: {path}")
+                return
+            seen.add(resolved)
+            input_files.append(path)
+        
+        for path_str in paths:
+            path = Path(path_str).expanduser()
+            try:
+                st = path.stat()
+            except OSError:
+                print(f"❌ エラー: 存在しないパスです: {path_str}")
+                continue
+            
+            if stat.S_ISDIR(st.st_mode):
+                video_files = self.get_video_files_from_directory(path)
+                if not video_files:
+                    print(f"❌ エラー: 動画ファイルが見つかりませんでした: {path_str}")
+                for video_file in video_files:
+                    add(video_file)
+            elif not stat.S_ISREG(st.st_mode):
+                print(f"❌ エラー: ファイルまたはディレクトリを指定してください: {path_str}")
+            elif path.suffix.lower() not in self.SUPPORTED_FORMATS:
+                print(f"❌ エラー: サポートされていない形式です: {path_str}")
+            else:
+                self._input_sizes[path] = st.st_size
+                add(path)
+        return input_files
+    
+    def run_batch(self, paths: List[str], target_size_mb: float,
+                  output_format: Optional[str] = None) -> bool:
+        """コマンドライン引数だけで圧縮する (対話なし)。全ファイル成功したら True"""
+        self._evict_probe_cache()
+        self.input_files = self.input_files_from_args(paths)
+        if not self.input_files:
+            return False
+        total = len(self.input_files)
+        probe_futures = self._probe_all(self.input_files)
         
         if self.dry_run:
-            print(f"\n✅ ドライラン完了! {total}個のファイルをシミュレートしました。")
-        else:
-            print(f"\n🎉 バッチ処理完了! {total}個のファイルを処理しました。")
+            succeeded = True
+            for i, (input_path, probe) in enumerate(zip(self.input_files, probe_futures), 1):
+                try:
+                    current_format = output_format if output_format else input_path.suffix[1:]
+                    self._dry_run_report(input_path, target_size_mb, current_format,
+                                         probe.result(), current=i, total=total)
+                except Exception as e:
+                    print(f"\n❌ エラー: {input_path.name} の処理に失敗: {e}")
+                    succeeded = False
+            return succeeded
+        
+        # 1本だけなら進捗バー付きでこのプロセスで圧縮する
+        if total == 1:
+            input_path = self.input_files[0]
+            current_format = output_format if output_format else input_path.suffix[1:]
+            self._compress_and_report(input_path, target_size_mb, current_format,
+                                      probe_futures[0].result())
+            return True
+        
+        outputs = self.compress_many(self.input_files, target_size_mb, output_format,
+                                     probe_futures)
+        print(f"\n🎉 バッチ処理完了! {len(outputs)}/{total}個のファイルを圧縮しました。")
+        return len(outputs) == total
+    
+    def _probe_in_background(self, files: List[Path]
+                             ) -> Tuple[queue.Queue, threading.Event, threading.Thread]:
+        """別スレッドで順番にffprobeし、(パス, 動画情報, 例外) をキューに流す
+        
+        キューは2件までなので、先読みしすぎない。返したEventをセットすると止まる。
+        キューからは _next_probe() で取り出す
+        """
+        probe_queue: queue.Queue = queue.Queue(maxsize=2)
+        stop = threading.Event()
+        
+        def worker():
+            for path in files:
+                try:
+                    item = (path, self.get_video_info(path), None)
+                except Exception as e:
+                    item = (path, None, e)
+                while not stop.is_set():
+                    try:
+                        probe_queue.put(item, timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+        
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        return probe_queue, stop, thread
+    
+    def _next_probe(self, probe_queue: queue.Queue, thread: threading.Thread) -> tuple:
+        """_probe_in_background() のキューから次の (パス, 動画情報, 例外) を取り出す
+        
+        キューを流すスレッドが途中で止まっていたら RuntimeError
+        """
+        while True:
+            # タイムアウトなしの get() だとWindowsでは Ctrl+C が効かないので、短く区切って待つ
+            try:
+                return probe_queue.get(timeout=0.5)
+            except queue.Empty:
+                pass
+            if not thread.is_alive():
+                # 止まる直前に入れた分は残っている
+                try:
+                    return probe_queue.get_nowait()
+                except queue.Empty:
+                    raise RuntimeError("動画情報の取得が途中で止まった")
     
     def _batch_mode_individual(self):
         """個別設定モード"""
         print("\n【個別設定モード】")
         
         total = len(self.input_files)
-        for i, input_path in enumerate(self.input_files, 1):
-            try:
-                print(f"\n{'='*60}")
-                print(f"[{i}/{total}] {input_path.name}")
-                print('='*60)
-                
-                video_info = self.get_video_info(input_path)
-                
-                # スキップオプション
-                skip = input("このファイルをスキップしますか？ (y/n): ").strip().lower()
-                if skip == 'y':
-                    print("⏭️  スキップしました。")
-                    continue
-                
-                # 目標サイズ入力
-                target_size_mb = self._phase2_get_target_size(input_path, video_info)
-                
-                # 拡張子変換
-                output_format = self._phase3_convert_format(input_path)
-                
-                # 圧縮実行 or ドライラン
-                if self.dry_run:
-                    self._dry_run_report(input_path, target_size_mb, output_format, 
-                                        video_info, current=i, total=total)
-                else:
-                    self._compress_and_report(input_path, target_size_mb, output_format, 
+        # 現在のファイルを処理している間に、次のファイルのffprobeを済ませておく
+        probe_queue, stop_probe, prober = self._probe_in_background(self.input_files)
+        try:
+            for i in range(1, total + 1):
+                try:
+                    input_path, video_info, probe_error = self._next_probe(probe_queue, prober)
+                except RuntimeError as e:
+                    print(f"\n❌ エラー: {e}")
+                    break
+                try:
+                    print(f"\n{'='*60}")
+                    print(f"[{i}/{total}] {input_path.name}")
+                    print('='*60)
+                    
+                    if probe_error is not None:
+                        raise probe_error
+                    
+                    # スキップオプション
+                    skip = input("このファイルをスキップしますか？ (y/n): ").strip().lower()
+                    if skip == 'y':
+                        print("⏭️  スキップしました。")
+                        continue
+                    
+                    # 目標サイズ入力
+                    target_size_mb = self._phase2_get_target_size(input_path, video_info)
+                    
+                    # 拡張子変換
+                    output_format = self._phase3_convert_format(input_path)
+                    
+                    # 圧縮実行 or ドライラン
+                    if self.dry_run:
+                        self._dry_run_report(input_path, target_size_mb, output_format, 
                                             video_info, current=i, total=total)
-                
-            except Exception as e:
-                print(f"\n❌ エラー: {input_path.name} の処理に失敗: {e}")
-                if not self.dry_run:
-                    continue_choice = input("続けますか？ (y/n): ").strip().lower()
-                    if continue_choice != 'y':
-                        break
+                    else:
+                        self._compress_and_report(input_path, target_size_mb, output_format, 
+                                                video_info, current=i, total=total)
+                    
+                except Exception as e:
+                    print(f"\n❌ エラー: {input_path.name} の処理に失敗: {e}")
+                    if not self.dry_run:
+                        continue_choice = input("続けますか？ (y/n): ").strip().lower()
+                        if continue_choice != 'y':
+                            break
+        finally:
+            stop_probe.set()
         
         if self.dry_run:
             print(f"\n✅ ドライラン完了! {total}個のファイルをシミュレートしました。")
@@ -422,12 +1465,14 @@ class VideoCompressor:
                        output_format: str, video_info: dict, 
                        current: int = 1, total: int = 1):
         """ドライラン結果レポート"""
-        current_size = self.get_file_size_mb(input_path)
-        duration = float(video_info['format']['duration'])
+        current_size = self._input_size_mb(input_path)
+        duration = self.video_meta(video_info).duration
         
         # ビットレート計算
         try:
-            video_bitrate = self.calculate_bitrate(target_size_mb, duration)
+            audio_args, audio_bits = self._pick_audio_args(video_info, 192, output_format)
+            video_bitrate, budget_bitrate = self._target_video_bitrate(video_info, target_size_mb,
+                                                                       audio_bits=audio_bits)
         except ValueError as e:
             print(f"\n❌ エラー: {e}")
             return
@@ -439,9 +1484,9 @@ class VideoCompressor:
         compression_ratio = (1 - target_size_mb / current_size) * 100
         
         # 出力ファイル名生成
-        timestamp = datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
-        stem = input_path.stem
-        output_name = f"{stem}--compressed--{target_size_mb:.1f}MB--{timestamp}.{output_format}"
+        output_path = self._build_output_path(input_path, target_size_mb, output_format,
+                                              index=current if total > 1 else 0)
+        output_name = output_path.name
         
         # レポート出力
         if total > 1:
@@ -456,48 +1501,84 @@ class VideoCompressor:
         print(f"動画の長さ: {self._format_time(duration)}")
         print()
         print("【エンコード設定】")
-        print(f"  ビデオビットレート: {video_bitrate} kbps")
-        print(f"  音声ビットレート: 192 kbps (AAC)")
-        print(f"  コーデック: H.264 (libx264)")
+        print(f"  ビデオビットレート: {self._describe_video_bitrate(video_bitrate, budget_bitrate)}")
+        print(f"  音声ビットレート: {self._describe_audio(audio_args, audio_bits, duration, 192)}")
+        print(f"  コーデック: H.264 ({self._video_encoder()})")
+        print(f"  レート制御: {self._describe_rate_control(video_info, video_bitrate, output_format, budget_bitrate)}")
         print()
         print("【予想画質】")
         print(f"  {quality_level}")
         print()
         print("【出力ファイル】")
         print(f"  ファイル名: {output_name}")
-        print(f"  保存先: {input_path.parent / output_name}")
+        print(f"  保存先: {output_path}")
         print("=" * 60)
         
         if total == 1:
             print("\n💡 実際に圧縮する場合は --dry-run オプションを外して実行してください。")
     
+    def _describe_rate_control(self, video_info: dict, video_bitrate: int,
+                               output_format: str, budget_bitrate: Optional[int] = None) -> str:
+        """レポート用のレート制御の説明"""
+        if self._can_copy_video(video_info, budget_bitrate or video_bitrate, output_format):
+            return "映像コピー (目標ビットレートが元の映像とほぼ同じため再エンコードしない)"
+        if self._video_encoder() != 'libx264':
+            return "1パスVBR (ハードウェアエンコード)"
+        if self.strict_size:
+            return "2パス (目標サイズに厳密に合わせる)"
+        
+        # CRFは内容次第で上限より小さくなる
+        crf_bitrate = self._estimate_crf_bitrate(video_info)
+        expected = min(crf_bitrate, video_bitrate) if crf_bitrate else video_bitrate
+        return f"CRF {self.CRF_VALUE} 1パス (上限 {video_bitrate} kbps / 予想 約{expected} kbps)"
+    
+    def _build_output_path(self, input_path: Path, target_size_mb: float, output_format: str,
+                           index: int = 0) -> Path:
+        """出力ファイルパスを生成
+        
+        タイムスタンプは実行ごとに共通。バッチ処理では同名ファイルが衝突しないよう
+        index (1始まり) を付ける
+        """
+        timestamp = self._run_timestamp
+        if index:
+            timestamp = f"{timestamp}--{index:03d}"
+        stem = input_path.stem
+        output_name = f"{stem}--compressed--{target_size_mb:.1f}MB--{timestamp}.{output_format}"
+        return input_path.parent / output_name
+    
     def _compress_and_report(self, input_path: Path, target_size_mb: float, 
                             output_format: str, video_info: dict, 
                             current: int = 1, total: int = 1):
         """圧縮実行と結果レポート"""
-        duration = float(video_info['format']['duration'])
+        duration = self.video_meta(video_info).duration
         
         # ビットレート計算
         try:
-            video_bitrate = self.calculate_bitrate(target_size_mb, duration)
+            audio_args, audio_bits = self._pick_audio_args(video_info, 192, output_format)
+            video_bitrate, budget_bitrate = self._target_video_bitrate(video_info, target_size_mb,
+                                                                       audio_bits=audio_bits)
             if total == 1:
                 print(f"\n📊 計算結果:")
-                print(f"  動画ビットレート: {video_bitrate} kbps")
-                print(f"  音声ビットレート: 192 kbps (音質優先)")
+                print(f"  動画ビットレート: {self._describe_video_bitrate(video_bitrate, budget_bitrate)}")
+                print(f"  音声ビットレート: {self._describe_audio(audio_args, audio_bits, duration, 192)}")
         except ValueError as e:
             raise RuntimeError(f"ビットレート計算エラー: {e}")
         
         # 出力ファイル名生成
-        timestamp = datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
-        stem = input_path.stem
-        output_name = f"{stem}--compressed--{target_size_mb:.1f}MB--{timestamp}.{output_format}"
-        output_path = input_path.parent / output_name
+        output_path = self._build_output_path(input_path, target_size_mb, output_format,
+                                              index=current if total > 1 else 0)
+        output_name = output_path.name
         
         # 圧縮実行
-        self.compress_video(input_path, output_path, video_bitrate, video_info, current, total)
+        rate_control = self.compress_video(input_path, output_path, video_bitrate, video_info,
+                                           current, total, use_crf=not self.strict_size,
+                                           budget_bitrate=budget_bitrate)
         
         # 完了レポート
         final_size = self.get_file_size_mb(output_path)
+        # CRFは目標サイズを上限として使うだけなので、学習には使わない
+        if rate_control in self.SIZE_RATIO_RATE_CONTROLS:
+            self._record_size_ratio(video_info, video_bitrate, final_size, audio_bits)
         print("\n" + "=" * 60)
         print("✅ 圧縮が完了し、圧縮した動画ファイルは保存されました!")
         print("=" * 60)
@@ -516,35 +1597,39 @@ class VideoCompressor:
             path_str = path_str.strip("'\"")
             path = Path(path_str).expanduser()
             
-            if not path.exists():
+            # 存在確認と種類の判定を stat 1回で済ませる
+            try:
+                st = path.stat()
+            except OSError:
                 print(f"❌ エラー: 存在しないパスです。正しいパスを入力してください。")
                 continue
             
             # ディレクトリの場合
-            if path.is_dir():
+            if stat.S_ISDIR(st.st_mode):
                 video_files = self.get_video_files_from_directory(path)
                 if not video_files:
                     print(f"❌ エラー: このディレクトリには動画ファイルが見つかりませんでした。")
-                    print(f"サポート形式: {', '.join(self.SUPPORTED_FORMATS)}")
+                    print(f"サポート形式: {', '.join(self.SUPPORTED_FORMATS_DISPLAY)}")
                     continue
                 return video_files
             
             # ファイルの場合
-            if not path.is_file():
+            if not stat.S_ISREG(st.st_mode):
                 print(f"❌ エラー: ファイルまたはディレクトリを指定してください。")
                 continue
             
             if path.suffix.lower() not in self.SUPPORTED_FORMATS:
                 print(f"❌ エラー: サポートされていない形式です。")
-                print(f"サポート形式: {', '.join(self.SUPPORTED_FORMATS)}")
+                print(f"サポート形式: {', '.join(self.SUPPORTED_FORMATS_DISPLAY)}")
                 continue
             
+            self._input_sizes[path] = st.st_size
             return [path]
     
     def _phase2_get_target_size(self, input_path: Path, video_info: dict) -> float:
         """フェーズ2: 目標サイズ入力"""
-        current_size = self.get_file_size_mb(input_path)
-        duration = float(video_info['format']['duration'])
+        current_size = self._input_size_mb(input_path)
+        duration = self.video_meta(video_info).duration
         
         print("\n【フェーズ2】")
         print(f"ファイル名: {input_path.name}")
@@ -602,48 +1687,119 @@ class VideoCompressor:
         self.target_size_mb = None
         self.output_format = None
         self.batch_mode = False
+        self._input_sizes = {}
+        self._parallel_jobs = 1
+
+
+# このワーカープロセスが Ctrl+C で中断されたか
+_worker_interrupted = False
+
+
+def _encode_one(compressor: VideoCompressor, input_path: Path, target_size_mb: float,
+                output_format: str, video_info: Optional[dict] = None,
+                audio_bitrate: int = 192, threads: int = 0,
+                index: int = 0) -> Tuple[Path, float, int, float, str]:
+    """1ファイルを圧縮する(ProcessPoolExecutorのワーカーから呼ばれる)
+    
+    引数と戻り値は VideoCompressor.compress_one と同じ。進捗表示は出さない。
+    一度中断されたワーカーは、先に受け取っていた残りのファイルを始めない
+    """
+    global _worker_interrupted
+    if _worker_interrupted:
+        raise KeyboardInterrupt
+    compressor.quiet = True
+    try:
+        return compressor.compress_one(input_path, target_size_mb, output_format, video_info,
+                                       audio_bitrate, threads, index)
+    except KeyboardInterrupt:
+        _worker_interrupted = True
+        raise
+
+
+def _positive_number(value: str, convert=float):
+    """argparse用: 0より大きい数だけを受け付ける"""
+    try:
+        number = convert(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"数字を指定してくれ: {value}")
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"0より大きい値を指定してくれ: {value}")
+    return number
+
+
+def _build_arg_parser() -> argparse.ArgumentParser:
+    """コマンドライン引数の定義"""
+    parser = argparse.ArgumentParser(
+        prog='compress_video.py',
+        description="動画圧縮ツール - 音質優先版。"
+                    "引数なしなら対話モード、ファイルと --target-mb を指定すると対話なしで圧縮する",
+        add_help=False,
+    )
+    parser.add_argument('inputs', nargs='*', metavar='PATH',
+                        help="圧縮する動画ファイルまたはディレクトリ (複数可)")
+    parser.add_argument('--inputs', dest='more_inputs', nargs='+', default=[], metavar='PATH',
+                        help="PATH と同じ (オプション形式で指定する場合)")
+    parser.add_argument('--target-mb', type=_positive_number, metavar='MB',
+                        help="各ファイルの目標サイズ (MB、小数点可)")
+    parser.add_argument('--format', dest='output_format', metavar='EXT',
+                        choices=[ext for ext, _ in VideoCompressor.CONVERT_FORMATS.values()],
+                        help="出力の拡張子 (省略時は入力と同じ)")
+    parser.add_argument('--parallel', type=lambda v: _positive_number(v, int), metavar='N',
+                        help="同時にエンコードするファイル数 (省略時はコア数から自動)")
+    parser.add_argument('--dry-run', '-d', action='store_true',
+                        help="実際の圧縮を行わず、計算結果のみ表示")
+    parser.add_argument('--strict-size', '-s', action='store_true',
+                        help="2パスエンコードで目標サイズに厳密に合わせる (時間は約2倍)")
+    parser.add_argument('--encoder', default='auto',
+                        choices=['auto', 'libx264'] + VideoCompressor.HW_ENCODERS,
+                        help="映像エンコーダー (省略時は auto: ハードウェアエンコーダーが使えれば"
+                             "1パスVBR、なければlibx264のCRF)")
+    parser.add_argument('--no-hw', dest='encoder', action='store_const', const='libx264',
+                        help="ハードウェアエンコーダーを使わない (--encoder libx264 と同じ)")
+    parser.add_argument('--version', '-v', action='version',
+                        version=f"動画圧縮ツール v{__version__}", help="バージョン情報を表示")
+    parser.add_argument('--help', '-h', action='help', help="このヘルプを表示")
+    return parser
 
 
 def main():
     """エントリーポイント"""
     # コマンドライン引数解析
-    dry_run = False
-    
-    if len(sys.argv) > 1:
-        if sys.argv[1] in ['--version', '-v']:
-            print(f"動画圧縮ツール v{__version__}")
-            sys.exit(0)
-        elif sys.argv[1] in ['--dry-run', '-d']:
-            dry_run = True
-            print("🔍 ドライランモード: 実際の圧縮は行わず、計算結果のみ表示します。")
-        elif sys.argv[1] in ['--help', '-h']:
-            print("動画圧縮ツール - 使い方")
-            print()
-            print("使用法:")
-            print("  ./compress_video.py              通常モード")
-            print("  ./compress_video.py --dry-run    ドライランモード")
-            print("  ./compress_video.py --version    バージョン表示")
-            print("  ./compress_video.py --help       ヘルプ表示")
-            print()
-            print("オプション:")
-            print("  --dry-run, -d    実際の圧縮を行わず、計算結果のみ表示")
-            print("  --version, -v    バージョン情報を表示")
-            print("  --help, -h       このヘルプを表示")
-            sys.exit(0)
+    parser = _build_arg_parser()
+    args = parser.parse_args()
+    inputs = args.inputs + args.more_inputs
+    if inputs and args.target_mb is None:
+        parser.error("ファイルを指定する場合は --target-mb も指定してくれ")
+    if not inputs and (args.target_mb is not None or args.output_format):
+        parser.error("--target-mb と --format はファイルと一緒に指定してくれ")
+    if args.strict_size and args.encoder not in ('auto', 'libx264'):
+        parser.error("--strict-size はlibx264の2パスなので、ハードウェアエンコーダーとは一緒に使えない")
+    
+    dry_run = args.dry_run
+    if dry_run:
+        print("🔍 ドライランモード: 実際の圧縮は行わず、計算結果のみ表示します。")
+    if args.strict_size:
+        print("🎯 厳密サイズモード: 2パスエンコードで目標サイズに合わせます。")
     
     try:
         print("=" * 60)
         print("🎥 動画圧縮ツール - 音質優先版")
         print("=" * 60)
         
-        compressor = VideoCompressor(dry_run=dry_run)
+        compressor = VideoCompressor(dry_run=dry_run, strict_size=args.strict_size,
+                                     max_parallel=args.parallel, encoder=args.encoder)
         
         if not compressor.check_ffmpeg():
-            print("\n❌ エラー: ffmpegがインストールされてないわ")
-            print("以下のコマンドでインストールしてくれ:")
+            print("\n❌ エラー: ffmpeg か ffprobe がインストールされてないわ")
+            print("以下のコマンドでインストールしてくれ (ffprobe も一緒に入る):")
             print("  brew install ffmpeg")
             sys.exit(1)
         
+        # 引数でファイルが指定されていれば、対話なしで処理して終わる
+        if inputs:
+            succeeded = compressor.run_batch(inputs, args.target_mb, args.output_format)
+            sys.exit(0 if succeeded else 1)
+        
         while True:
             compressor.run()
             